@@ -142,8 +142,12 @@ options g_ether use_eem=0 use_ecm=1
 EOF
 
   # Load gadget now (uses modprobe.d options)
-  if ! lsmod | grep -q '^g_ether'; then
+  if ! grep -q '^g_ether ' /proc/modules; then
     modprobe g_ether || true
-    sleep 2
+    # Wait for usb0 to register (up to 3s) rather than a fixed sleep
+    for _ in {1..30}; do
+      [ -e /sys/class/net/usb0 ] && break
+      sleep 0.1
+    done
   fi
 }
@@ -161,10 +161,11 @@ mkdir -p functions/ecm.usb0
 [ -n "$HOST_MAC" ] && echo "$HOST_MAC" > functions/ecm.usb0/host_addr || true
 ln -sf functions/acm.usb0 configs/c.1/
 ln -sf functions/ecm.usb0 configs/c.1/
-UDC=$(ls /sys/class/udc 2>/dev/null | head -n1 || true)
+UDC=""
+for u in /sys/class/udc/*; do [ -e "$u" ] && UDC=${u##*/}; break; done
 [ -n "$UDC" ] && echo "$UDC" > UDC || true
 # Bring up usb0 with STATIC_IP if present
-if [ -n "$STATIC_IP" ] && ip link show usb0 >/dev/null 2>&1; then
+if [ -n "$STATIC_IP" ] && [ -e /sys/class/net/usb0 ]; then
   ip addr add "$STATIC_IP" dev usb0 2>/dev/null || true
   ip link set usb0 up || true
 fi
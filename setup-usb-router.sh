@@ -20,24 +20,111 @@ TAILSCALE_INTERFACE="tailscale0"
 OPENVPN_INTERFACE="tun0"
 USE_TAILSCALE_EXIT="${USE_TAILSCALE_EXIT:-true}"  # Default: route through VPN only
 USE_VPN_FAILOVER="${USE_VPN_FAILOVER:-true}"  # Enable automatic VPN failover
+USB_ROUTER_DEBUG="${USB_ROUTER_DEBUG:-false}"  # Verbose service logging (per-query DNS/DHCP logs)
+
+# Derived once from the values above and reused by every config writer
+USB_PREFIX="${USB_NETWORK#*/}"
+USB_CIDR="$USB_IP/$USB_PREFIX"
+
+# Colors for output, only on a terminal: redirected output (a log file,
+# tee, cloud-init) gets plain text instead of escape codes
+if [ -t 1 ]; then
+    RED=$'\033[0;31m'
+    GREEN=$'\033[0;32m'
+    YELLOW=$'\033[1;33m'
+    NC=$'\033[0m' # No Color
+else
+    RED='' GREEN='' YELLOW='' NC=''
+fi
 
-# Colors for output
-RED='\033[0;31m'
-GREEN='\033[0;32m'
-YELLOW='\033[1;33m'
-NC='\033[0m' # No Color
+# Logging functions. Prefixes are built once; each message is one printf,
+# printed as-is (no echo -e escape processing of the message text).
+LOG_INFO_PREFIX="${GREEN}[INFO]${NC} "
+LOG_WARN_PREFIX="${YELLOW}[WARN]${NC} "
+LOG_ERROR_PREFIX="${RED}[ERROR]${NC} "
 
-# Logging functions
 log_info() {
-    echo -e "${GREEN}[INFO]${NC} $1"
+    printf '%s\n' "$LOG_INFO_PREFIX$1"
 }
 
 log_warn() {
-    echo -e "${YELLOW}[WARN]${NC} $1"
+    printf '%s\n' "$LOG_WARN_PREFIX$1"
 }
 
 log_error() {
-    echo -e "${RED}[ERROR]${NC} $1"
+    printf '%s\n' "$LOG_ERROR_PREFIX$1"
+}
+
+# Write stdin to a file unless it already holds exactly that content.
+# The new content goes to a temp file in the same directory and is renamed
+# into place, so inotify/path watchers never see a truncated or partial file.
+# Sets CONFIG_CHANGED=true when the file was written, so callers can skip
+# reloading its consumer (netplan apply, networkd restart, ...) on re-runs.
+# Optional second argument is the file mode (default 644).
+CONFIG_CHANGED=false
+write_if_changed() {
+    local path=$1 mode=${2:-644} tmp
+    tmp=$(mktemp "$path.XXXXXX")
+    cat > "$tmp"
+    if cmp -s "$tmp" "$path"; then
+        rm -f "$tmp"
+        return 0
+    fi
+    chmod "$mode" "$tmp"
+    mv -f "$tmp" "$path"
+    CONFIG_CHANGED=true
+}
+
+# Unit files written during setup only mark the manager as needing a reload
+# and queue their units in ENABLE_UNITS; main() then issues a single
+# daemon-reload and a single multi-unit enable once everything is in place,
+# since each reload re-parses every unit file on the system.
+NEEDS_DAEMON_RELOAD=false
+ENABLE_UNITS=()
+finalize_systemd_units() {
+    if [ "$NEEDS_DAEMON_RELOAD" = true ]; then
+        systemctl daemon-reload
+        NEEDS_DAEMON_RELOAD=false
+    fi
+    if [ ${#ENABLE_UNITS[@]} -gt 0 ]; then
+        # --no-reload: enable would otherwise trigger its own daemon-reload
+        systemctl enable --no-reload "${ENABLE_UNITS[@]}"
+        ENABLE_UNITS=()
+    fi
+}
+
+# write_if_changed for systemd unit files and drop-ins: only queue a
+# daemon-reload when the content actually changed, so idempotent re-runs
+# never touch the manager.
+write_unit() {
+    CONFIG_CHANGED=false
+    write_if_changed "$1"
+    if [ "$CONFIG_CHANGED" = "true" ]; then
+        NEEDS_DAEMON_RELOAD=true
+    fi
+}
+
+# True if the network interface exists in sysfs
+iface_exists() {
+    [ -e "/sys/class/net/$1" ]
+}
+
+# Wait (up to ~3s, with backoff) for a network interface to appear, e.g.
+# usb0 after modprobe g_ether. Returns as soon as the sysfs entry exists
+# instead of sleeping a fixed time; operstate stays "down" until a host is
+# attached, so existence is the only thing worth waiting for here.
+wait_for_iface() {
+    local delay
+    for delay in 0.05 0.1 0.2 0.4 0.8 1.45; do
+        iface_exists "$1" && return 0
+        sleep "$delay"
+    done
+    iface_exists "$1"
+}
+
+# True if a kernel module is loaded (read /proc/modules directly, as lsmod does)
+module_loaded() {
+    grep -q "^$1 " /proc/modules 2>/dev/null
 }
 
 # Check if running as root
@@ -48,6 +135,14 @@ check_root() {
     fi
 }
 
+# The helper scripts rely on bash 5 (EPOCHSECONDS, EPOCHREALTIME, wait -n)
+check_bash_version() {
+    if (( BASH_VERSINFO[0] < 5 )); then
+        log_error "bash 5.0 or newer is required (found $BASH_VERSION)"
+        exit 1
+    fi
+}
+
 # Detect the distribution
 detect_distro() {
     if [ -f /etc/os-release ]; then
@@ -66,14 +161,48 @@ detect_distro() {
     fi
 }
 
+# Dotted quad to integer, stored in IP_INT
+ip_to_int() {
+    local a b c d
+    IFS=. read -r a b c d <<< "$1"
+    IP_INT=$(( (a << 24) | (b << 16) | (c << 8) | d ))
+}
+
+# Make sure the router address and DHCP pool sit inside USB_NETWORK.
+# The network and mask are turned into integers once; each address check
+# is then a single AND and compare.
+validate_network_config() {
+    local net mask addr
+    ip_to_int "${USB_NETWORK%/*}"
+    mask=$(( (0xffffffff << (32 - USB_PREFIX)) & 0xffffffff ))
+    net=$(( IP_INT & mask ))
+    for addr in "$USB_IP" "$USB_DHCP_START" "$USB_DHCP_END"; do
+        ip_to_int "$addr"
+        if (( (IP_INT & mask) != net )); then
+            log_error "$addr is not inside $USB_NETWORK"
+            exit 1
+        fi
+    done
+}
+
 # Board plugin loader (sources boards/*/setup.sh and selects matching board)
 BOARD_NAME=""
 BOARD_OVERRIDES_GADGET=false
 
 load_board_plugin() {
-    local script_dir boards_dir f
+    local script_dir boards_dir f forced
     script_dir="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
     boards_dir="$script_dir/boards"
+    # BOARD naming a plugin directory loads just that plugin instead of
+    # sourcing every plugin and running its detection
+    forced="${BOARD:-${FORCE_BOARD:-}}"
+    if [ -n "$forced" ] && [ -f "$boards_dir/$forced/setup.sh" ]; then
+        # shellcheck source=/dev/null
+        . "$boards_dir/$forced/setup.sh"
+        : "${BOARD_NAME:=$forced}"
+        log_info "Board selected: $BOARD_NAME (plugin: $forced)"
+        return 0
+    fi
     for f in "$boards_dir"/*/setup.sh; do
         [ -f "$f" ] || continue
         # shellcheck source=/dev/null
@@ -124,10 +253,16 @@ install_packages() {
                 fi
             fi
             
-            # Check which packages need to be installed
+            # Check which packages need to be installed: one dpkg-query for
+            # the whole list, then set lookups instead of a dpkg+grep per package
             local to_install=()
+            local -A installed=()
+            local name state
+            while read -r name state; do
+                [ "$state" = "ii" ] && installed[$name]=1
+            done < <(dpkg-query -W -f='${Package} ${db:Status-Abbrev}\n' "${packages[@]}" 2>/dev/null)
             for pkg in "${packages[@]}"; do
-                if ! dpkg -l "$pkg" 2>/dev/null | grep -q "^ii"; then
+                if [ -z "${installed[$pkg]:-}" ]; then
                     to_install+=("$pkg")
                 fi
             done
@@ -159,23 +294,24 @@ setup_usb_gadget() {
     fi
     
     # Standard configuration for generic boards
-    cat > /etc/modules-load.d/usb_gadget.conf << EOF
+    write_if_changed /etc/modules-load.d/usb_gadget.conf << EOF
 # USB Ethernet Gadget
 g_ether
 EOF
     
     # Create modprobe configuration for g_ether
-    cat > /etc/modprobe.d/g_ether.conf << EOF
+    CONFIG_CHANGED=false
+    write_if_changed /etc/modprobe.d/g_ether.conf << EOF
 # Use CDC-ECM mode for better macOS compatibility
 options g_ether use_eem=0 use_ecm=1
 EOF
 
     # Load the module now if not already loaded
-    if ! lsmod | grep -q g_ether; then
+    if ! module_loaded g_ether; then
         # Load without parameters so it uses /etc/modprobe.d/g_ether.conf
         modprobe g_ether
-        sleep 2
-    else
+        wait_for_iface "$USB_INTERFACE" || log_warn "$USB_INTERFACE did not appear after loading g_ether"
+    elif [ "$CONFIG_CHANGED" = "true" ]; then
         log_info "g_ether already loaded - may need reboot for new options to take effect"
     fi
 }
@@ -188,9 +324,9 @@ setup_network_interface() {
     if systemctl is-active NetworkManager &>/dev/null; then
         log_info "Configuring via NetworkManager..."
         if ! nmcli -t -f NAME con show | grep -Fxq "USB Gadget"; then
-            nmcli con add type ethernet ifname "$USB_INTERFACE" con-name "USB Gadget" ipv4.method manual ipv4.addresses "$USB_IP/24" ipv6.method ignore autoconnect yes || true
+            nmcli con add type ethernet ifname "$USB_INTERFACE" con-name "USB Gadget" ipv4.method manual ipv4.addresses "$USB_CIDR" ipv6.method ignore autoconnect yes || true
         else
-            nmcli con mod "USB Gadget" ipv4.method manual ipv4.addresses "$USB_IP/24" ipv6.method ignore autoconnect yes || true
+            nmcli con mod "USB Gadget" ipv4.method manual ipv4.addresses "$USB_CIDR" ipv6.method ignore autoconnect yes || true
         fi
         nmcli con up "USB Gadget" || true
 
@@ -198,34 +334,42 @@ setup_network_interface() {
     elif systemctl is-enabled systemd-networkd &>/dev/null || [ -d /etc/systemd/network ]; then
         log_info "Configuring via systemd-networkd..."
         # Remove any old configs with wrong IP
-        rm -f /etc/systemd/network/*usb0*.network 2>/dev/null
+        local f
+        for f in /etc/systemd/network/*usb0*.network; do
+            [ "$f" = /etc/systemd/network/20-usb0.network ] || rm -f "$f"
+        done
         
-        cat > /etc/systemd/network/20-usb0.network << EOF
+        CONFIG_CHANGED=false
+        write_if_changed /etc/systemd/network/20-usb0.network << EOF
 [Match]
 Name=$USB_INTERFACE
 
 [Network]
-Address=$USB_IP/24
+Address=$USB_CIDR
 ConfigureWithoutCarrier=yes
 
 [Link]
 RequiredForOnline=no
 EOF
         systemctl enable systemd-networkd 2>/dev/null || true
-        systemctl restart systemd-networkd || true
+        if [ "$CONFIG_CHANGED" = "true" ]; then
+            systemctl restart systemd-networkd || true
+        fi
     elif [ -d /etc/netplan ]; then
         # Netplan configuration
-        cat > /etc/netplan/40-usb0.yaml << EOF
+        CONFIG_CHANGED=false
+        write_if_changed /etc/netplan/40-usb0.yaml 600 << EOF
 network:
   version: 2
   ethernets:
     $USB_INTERFACE:
       addresses:
-        - $USB_IP/24
+        - $USB_CIDR
       optional: true
 EOF
-        chmod 600 /etc/netplan/40-usb0.yaml
-        netplan apply || true
+        if [ "$CONFIG_CHANGED" = "true" ]; then
+            netplan apply || true
+        fi
     else
         # Traditional /etc/network/interfaces
         if ! grep -q "$USB_INTERFACE" /etc/network/interfaces; then
@@ -234,13 +378,15 @@ EOF
 # USB Ethernet Gadget Interface
 auto $USB_INTERFACE
 iface $USB_INTERFACE inet static
-    address $USB_IP
-    netmask 255.255.255.0
+    address $USB_CIDR
 EOF
         fi
     fi
 }
 
+# Set when dnsmasq's config or unit drop-in changed; main() only restarts it then
+DNSMASQ_CHANGED=false
+
 # Configure DHCP server
 setup_dhcp_server() {
     log_info "Configuring DHCP server..."
@@ -248,18 +394,26 @@ setup_dhcp_server() {
     # Stop and disable systemd-resolved to avoid port 53 conflicts
     if systemctl is-active systemd-resolved &>/dev/null; then
         log_info "Disabling systemd-resolved to avoid conflicts..."
-        systemctl stop systemd-resolved
-        systemctl disable systemd-resolved
+        systemctl disable --now systemd-resolved
     fi
     
-    # Backup original dnsmasq config if exists
-    [ -f /etc/dnsmasq.conf ] && cp /etc/dnsmasq.conf /etc/dnsmasq.conf.bak
+    # Backup original dnsmasq config if exists (once, so re-runs keep the distro original)
+    if [ -f /etc/dnsmasq.conf ] && [ ! -f /etc/dnsmasq.conf.bak ]; then
+        cp /etc/dnsmasq.conf /etc/dnsmasq.conf.bak
+    fi
     
     # Clear any existing dnsmasq.d configs that might conflict
     rm -f /etc/dnsmasq.d/*.conf 2>/dev/null
     
+    # Per-query/per-lease logging costs a log write for every DNS lookup; debug only
+    local logging="# log-dhcp/log-queries: set USB_ROUTER_DEBUG=true"
+    if [ "$USB_ROUTER_DEBUG" = "true" ]; then
+        logging=$'log-dhcp\nlog-queries'
+    fi
+    
     # Create main dnsmasq configuration
-    cat > /etc/dnsmasq.conf << EOF
+    CONFIG_CHANGED=false
+    write_if_changed /etc/dnsmasq.conf << EOF
 # DHCP Configuration for USB Ethernet Gadget
 interface=$USB_INTERFACE
 bind-interfaces
@@ -272,19 +426,20 @@ dhcp-option=6,$USB_IP
 port=53
 server=8.8.8.8
 server=1.1.1.1
-cache-size=150
+cache-size=4096
 domain-needed
 bogus-priv
 
 # Logging
-log-dhcp
-log-queries
+$logging
 log-facility=/var/log/dnsmasq.log
 EOF
 
+    DNSMASQ_CHANGED=$CONFIG_CHANGED
+    
     # Create systemd override to ensure dnsmasq starts after usb0
     mkdir -p /etc/systemd/system/dnsmasq.service.d
-    cat > /etc/systemd/system/dnsmasq.service.d/wait-for-usb0.conf << EOF
+    write_unit /etc/systemd/system/dnsmasq.service.d/wait-for-usb0.conf << EOF
 [Unit]
 After=sys-subsystem-net-devices-$USB_INTERFACE.device
 Wants=sys-subsystem-net-devices-$USB_INTERFACE.device
@@ -294,27 +449,29 @@ Wants=sys-subsystem-net-devices-$USB_INTERFACE.device
 Restart=on-failure
 RestartSec=5s
 EOF
+    if [ "$CONFIG_CHANGED" = "true" ]; then
+        DNSMASQ_CHANGED=true
+    fi
 
-    systemctl daemon-reload
-    systemctl enable dnsmasq
+    ENABLE_UNITS+=(dnsmasq.service)
 }
 
-# Configure IP forwarding and NAT
-setup_nat() {
-    log_info "Configuring IP forwarding and NAT..."
-    
-    # Enable IP forwarding
-    echo "net.ipv4.ip_forward=1" > /etc/sysctl.d/30-ip-forward.conf
-    sysctl -w net.ipv4.ip_forward=1
-    
-    # Use nftables: create dedicated tables that lock down forwarding and apply masquerade
-    # Clean up previous runs
-    if command -v nft &>/dev/null; then
-        nft list table inet usb_router_filter &>/dev/null && nft delete table inet usb_router_filter || true
-        nft list table ip usb_router_nat &>/dev/null && nft delete table ip usb_router_nat || true
-        
-        # Build ruleset: only allow usb0 -> tailscale0/tun0 and established back; drop everything else on forward
-        nft -f - <<EOF
+# True if a routing table with this exact name is declared in rt_tables
+rt_table_exists() {
+    local id name
+    [ -f /etc/iproute2/rt_tables ] || return 1
+    while read -r id name _; do
+        [[ $id == \#* ]] && continue
+        [ "$name" = "$1" ] && return 0
+    done < /etc/iproute2/rt_tables
+    return 1
+}
+
+# Print the router's nftables tables: forward only usb0 -> tailscale0/tun0
+# (plus established traffic back) and masquerade USB clients on the VPNs.
+# Rendered once per run and shared by the live load and /etc/nftables.conf.
+nft_router_tables() {
+    cat <<EOF
 table inet usb_router_filter {
   chain forward {
     type filter hook forward priority 0;
@@ -334,46 +491,97 @@ table ip usb_router_nat {
   }
 }
 EOF
-        log_info "Applied nftables rules: forward only usb0->tailscale0/tun0 with masquerade"
-    else
+}
+
+# Configure IP forwarding and NAT
+setup_nat() {
+    log_info "Configuring IP forwarding and NAT..."
+    
+    # Enable IP forwarding
+    write_if_changed /etc/sysctl.d/30-ip-forward.conf <<< "net.ipv4.ip_forward=1"
+    sysctl -w net.ipv4.ip_forward=1
+    
+    # Use nftables: create dedicated tables that lock down forwarding and apply masquerade
+    local nft_tables
+    nft_tables=$(nft_router_tables)
+    # Copy of the tables last loaded into the kernel; lives in /run so it is
+    # dropped together with the kernel ruleset on reboot
+    local nft_applied=/run/usb-router/nft-tables
+    # Looked up once: both the apply and the persist steps below need it,
+    # and hash also remembers the path for every later nft call
+    local have_nft=false
+    if hash nft 2>/dev/null; then
+        have_nft=true
+    fi
+    if [ "$have_nft" != true ]; then
         log_warn "nft command not found; cannot apply nftables rules"
+    elif [ -f "$nft_applied" ] && [ "$(< "$nft_applied")" = "$nft_tables" ] \
+        && nft list table inet usb_router_filter &>/dev/null \
+        && nft list table ip usb_router_nat &>/dev/null; then
+        log_info "nftables rules unchanged and loaded; leaving them in place"
+    else
+        # Build ruleset: only allow usb0 -> tailscale0/tun0 and established back; drop everything else on forward.
+        # Clearing previous runs happens in the same batch ("add" is a no-op for an existing table,
+        # so the deletes never fail), making the replace one atomic transaction and one nft call.
+        nft -f - <<EOF
+table inet usb_router_filter
+delete table inet usb_router_filter
+table ip usb_router_nat
+delete table ip usb_router_nat
+
+$nft_tables
+EOF
+        mkdir -p /run/usb-router
+        printf '%s\n' "$nft_tables" > "$nft_applied"
+        log_info "Applied nftables rules: forward only usb0->tailscale0/tun0 with masquerade"
     fi
     
     if [ "$USE_TAILSCALE_EXIT" = "true" ]; then
         log_info "Setting up VPN-only routing for USB clients"
         
         # Create custom routing table for USB clients
-        if ! grep -q "usb_vpn" /etc/iproute2/rt_tables; then
+        if ! rt_table_exists usb_vpn; then
+            mkdir -p /etc/iproute2
             echo "200 usb_vpn" >> /etc/iproute2/rt_tables
         fi
         
-        # Only route USB client traffic through VPN, not the device's own traffic
-        ip rule del from $USB_NETWORK table usb_vpn 2>/dev/null || true
-        ip rule add from $USB_NETWORK table usb_vpn priority 200
+        # Only route USB client traffic through VPN, not the device's own traffic,
+        # and keep local traffic on the main table. Rules go through `ip -batch`:
+        # one netlink session for all of them. Stale copies from earlier runs are
+        # removed first (-force: keep going when a rule is not there).
+        ip -force -batch - 2>/dev/null <<EOF || true
+rule del from $USB_NETWORK table usb_vpn
+rule del from 192.168.0.0/16 to 192.168.0.0/16 table main priority 50
+rule del from 10.0.0.0/8 to 10.0.0.0/8 table main priority 50
+EOF
+        ip -batch - <<EOF
+rule add from $USB_NETWORK table usb_vpn priority 200
+rule add from 192.168.0.0/16 to 192.168.0.0/16 table main priority 50
+rule add from 10.0.0.0/8 to 10.0.0.0/8 table main priority 50
+EOF
         
-        # Wait for Tailscale interface
+        # Wait for Tailscale interface (up to 20s), returning as soon as it appears
         local attempts=0
-        while [ $attempts -lt 10 ] && ! ip link show $TAILSCALE_INTERFACE &>/dev/null; do
+        if ! iface_exists $TAILSCALE_INTERFACE; then
             log_info "Waiting for Tailscale interface..."
-            sleep 2
-            ((attempts++))
+        fi
+        while [ $attempts -lt 40 ] && ! iface_exists $TAILSCALE_INTERFACE; do
+            sleep 0.5
+            attempts=$((attempts + 1))
         done
         
         # Add default route through Tailscale for USB clients only
-        if ip link show $TAILSCALE_INTERFACE &>/dev/null; then
-            local ts_gateway=$(ip route show dev $TAILSCALE_INTERFACE | grep -E '^100\.' | head -1 | awk '{print $1}')
+        if iface_exists $TAILSCALE_INTERFACE; then
+            local ts_gateway=$(ip route show dev $TAILSCALE_INTERFACE | awk '/^100\./ {print $1; exit}')
             if [ -n "$ts_gateway" ]; then
-                ip route add default via $ts_gateway dev $TAILSCALE_INTERFACE table usb_vpn 2>/dev/null || true
+                # replace: also updates a route left by an earlier run
+                ip route replace default via $ts_gateway dev $TAILSCALE_INTERFACE table usb_vpn 2>/dev/null || true
             fi
         fi
         
         # Forwarding and masquerade already handled by nftables above
         log_info "USB clients can ONLY route through VPN interfaces (nftables enforced)"
         
-        # Ensure local traffic is not affected
-        ip rule add from 192.168.0.0/16 to 192.168.0.0/16 table main priority 50
-        ip rule add from 10.0.0.0/8 to 10.0.0.0/8 table main priority 50
-        
         log_info "No leaks possible: forwarding restricted to ${TAILSCALE_INTERFACE} and ${OPENVPN_INTERFACE}"
     else
         # Even when not using Tailscale exit, keep forwarding restricted to VPN interfaces only
@@ -392,40 +600,31 @@ EOF
         in_chroot=true
     fi
 
-    if command -v nft &>/dev/null; then
+    if [ "$have_nft" = true ]; then
         if [ "$in_chroot" = true ]; then
             # In chroot: don't query host kernel ruleset; write our intended config directly
             log_info "Chroot detected: writing nftables config to /etc/nftables.conf without querying kernel"
-            cat > /etc/nftables.conf << EOF
+            write_if_changed /etc/nftables.conf << EOF
 #!/usr/sbin/nft -f
 flush ruleset
 
-table inet usb_router_filter {
-  chain forward {
-    type filter hook forward priority 0;
-    policy drop;
-    ct state established,related accept
-    iifname "${USB_INTERFACE}" oifname "${TAILSCALE_INTERFACE}" accept
-    iifname "${USB_INTERFACE}" oifname "${OPENVPN_INTERFACE}" accept
-    oifname "${USB_INTERFACE}" ct state related,established accept
-  }
-}
-
-table ip usb_router_nat {
-  chain postrouting {
-    type nat hook postrouting priority 100;
-    ip saddr ${USB_NETWORK} oifname "${TAILSCALE_INTERFACE}" masquerade
-    ip saddr ${USB_NETWORK} oifname "${OPENVPN_INTERFACE}" masquerade
-  }
-}
+$nft_tables
 EOF
             # Skip systemctl in chroot
         else
             # On a real system, persist the live ruleset and enable service
             log_info "Writing current nftables ruleset to /etc/nftables.conf and enabling nftables service"
-            nft list ruleset > /etc/nftables.conf 2>/dev/null || true
+            local ruleset
+            CONFIG_CHANGED=false
+            # -s (stateless): omit counters so the dump is stable across runs
+            if ruleset=$(nft -s list ruleset 2>/dev/null); then
+                write_if_changed /etc/nftables.conf <<< "$ruleset"
+            fi
             systemctl enable nftables 2>/dev/null || true
-            systemctl restart nftables 2>/dev/null || true
+            # The file mirrors the live ruleset; reloading it only matters when it changed
+            if [ "$CONFIG_CHANGED" = "true" ]; then
+                systemctl restart nftables 2>/dev/null || true
+            fi
         fi
     fi
 
@@ -440,7 +639,7 @@ setup_openvpn() {
     mkdir -p /etc/openvpn/client
     
     # Create a template systemd service for OpenVPN clients
-    cat > /etc/systemd/system/openvpn-client@.service << EOF
+    write_unit /etc/systemd/system/openvpn-client@.service << EOF
 [Unit]
 Description=OpenVPN client for %i
 After=network.target
@@ -455,8 +654,6 @@ RestartSec=5s
 [Install]
 WantedBy=multi-user.target
 EOF
-
-    systemctl daemon-reload
     
     log_info "OpenVPN client installed. Place your .ovpn files in /etc/openvpn/client/"
     log_info "Start with: systemctl start openvpn-client@configname"
@@ -479,12 +676,11 @@ setup_tailscale() {
         fi
     fi
     
-    systemctl enable tailscaled
-    systemctl start tailscaled
+    systemctl enable --now tailscaled
     
     # Configure Tailscale to accept subnet routes and act as exit node
     mkdir -p /etc/sysctl.d
-    cat > /etc/sysctl.d/99-tailscale.conf << EOF
+    write_if_changed /etc/sysctl.d/99-tailscale.conf << EOF
 # Enable IP forwarding for Tailscale
 net.ipv4.ip_forward = 1
 net.ipv6.conf.all.forwarding = 1
@@ -494,7 +690,7 @@ EOF
     # If USE_TAILSCALE_EXIT is true, we'll use split routing (USB clients only)
     if [ "$USE_TAILSCALE_EXIT" = "true" ]; then
         log_info "Checking Tailscale authentication status..."
-        if tailscale status &>/dev/null; then
+        if tailscale status --peers=false &>/dev/null; then
             log_info "Tailscale is authenticated"
             log_info "Split routing will be configured - USB clients through VPN, device keeps local access"
             
@@ -516,87 +712,467 @@ EOF
 create_helper_scripts() {
     log_info "Creating helper scripts..."
     
+    # Library sourced by the helper scripts below
+    mkdir -p /usr/local/lib/usb-router
+    write_if_changed /usr/local/lib/usb-router/common.sh << 'EOF'
+#!/bin/bash
+# Shared helpers for the usb-router-* scripts. Source, don't execute.
+
+USB_ROUTER_RUN_DIR="/run/usb-router"
+
+# Everything these scripts run (ip, ss, systemctl, jq) is either parsed or
+# matched on: the C locale keeps that output and its error messages fixed,
+# makes bash patterns byte-wise, and spares each child loading locale data
+export LC_ALL=C
+
+# Open $1 as fd 3, the log_at file copy, once per script (/dev/null if unwritable)
+log_open() {
+    { exec 3>>"$1"; } 2>/dev/null || exec 3>/dev/null
+}
+
+# Syslog priority ceiling for log_at: info, or debug with USB_ROUTER_DEBUG=true
+LOG_MAX_PRIO=6
+if [ "${USB_ROUTER_DEBUG:-false}" = "true" ]; then
+    LOG_MAX_PRIO=7
+fi
+LOG_STAMP_SEC=""
+LOG_STAMP=""
+# Log $2 at syslog priority $1 to stdout (journal: <N> prefix, no stamp) and fd 3
+log_at() {
+    if (( $1 > LOG_MAX_PRIO )); then
+        return 0
+    fi
+    if [ "$EPOCHSECONDS" != "$LOG_STAMP_SEC" ]; then
+        LOG_STAMP_SEC=$EPOCHSECONDS
+        printf -v LOG_STAMP '%(%Y-%m-%d %H:%M:%S)T' "$LOG_STAMP_SEC"
+    fi
+    if [ -n "${JOURNAL_STREAM:-}" ]; then
+        echo "<$1>$2"
+    else
+        echo "[$LOG_STAMP] $2"
+    fi
+    echo "[$LOG_STAMP] $2" >&3
+}
+
+log_msg() {
+    log_at 6 "$1"
+}
+
+log_warning() {
+    log_at 4 "WARNING: $1"
+}
+
+log_debug() {
+    log_at 7 "$1"
+}
+
+# True if the network interface exists in sysfs
+iface_exists() {
+    [ -e "/sys/class/net/$1" ]
+}
+
+# Fill the associative arrays UNIT_STATE (active, inactive, failed, ...)
+# and UNIT_SUBSTATE (running, exited, dead, ...) for each unit given.
+# systemctl show takes several units and prints one blank-line separated
+# Key=Value block per unit, in argument order, so a single call covers
+# every unit a report needs.
+unit_states() {
+    local units=("$@") i=0 key value
+    declare -gA UNIT_STATE UNIT_SUBSTATE
+    for key in "${units[@]}"; do
+        UNIT_STATE[$key]=unknown
+        UNIT_SUBSTATE[$key]=""
+    done
+    while IFS='=' read -r key value; do
+        case $key in
+            ActiveState) UNIT_STATE[${units[$i]}]=$value ;;
+            SubState) UNIT_SUBSTATE[${units[$i]}]=$value ;;
+            "") i=$((i + 1)) ;;
+        esac
+    done < <(systemctl show -p ActiveState -p SubState "${units[@]}" 2>/dev/null)
+}
+EOF
+    write_if_changed /usr/local/lib/usb-router/tailscale.sh << 'EOF'
+#!/bin/bash
+# Tailscale status helpers for the usb-router-* scripts. Kept apart from
+# common.sh so the monitor and watchdog, which never talk to Tailscale,
+# don't parse them on every start. Source after common.sh, don't execute.
+
+TS_STATUS_TTL="${USB_ROUTER_TS_TTL:-2}"
+# Seconds to wait for tailscaled (and for another caller's fetch) before giving up
+TS_STATUS_TIMEOUT=5
+
+# Looked up once when sourced; the Tailscale helpers return straight away
+# on devices without the CLI
+TS_INSTALLED=false
+hash tailscale 2>/dev/null && TS_INSTALLED=true
+
+TS_STATUS_CACHE="$USB_ROUTER_RUN_DIR/tailscale-status.json"
+TS_SUMMARY_CACHE="$USB_ROUTER_RUN_DIR/tailscale-exit-nodes"
+
+# Everything the helpers need from the status JSON, in one jq pass: the
+# backend state ("Running" once logged in and up), the exit node in use
+# (empty line if none), then the sorted hostnames of the peers offering to
+# be an exit node, one per line.
+TS_SUMMARY_JQ='(.Peer // {}) as $peers
+  | (.BackendState // ""),
+    (first($peers[] | select(.ExitNode) | .HostName) // ""),
+    ([$peers[] | select(.ExitNodeOption) | .HostName] | sort | .[])'
+
+ts_cache_usable() {
+    [ "$TS_STATUS_TTL" -gt 0 ] 2>/dev/null && mkdir -p "$USB_ROUTER_RUN_DIR" 2>/dev/null && [ -w "$USB_ROUTER_RUN_DIR" ]
+}
+
+# Refetch `tailscale status --json` into the runtime dir once it is older
+# than TS_STATUS_TTL seconds. Refreshes are serialized with a lock, so
+# helpers polling at the same time share one fetch from tailscaled, and
+# the exit node summary is parsed out right away, so readers never have
+# to run jq over the (potentially large) peer list themselves.
+ts_status_refresh() {
+    [ "$TS_INSTALLED" = true ] && ts_cache_usable || return 1
+    (
+        flock -w "$TS_STATUS_TIMEOUT" 8 || exit 1
+        if [ -s "$TS_STATUS_CACHE" ] && [ $((EPOCHSECONDS - $(stat -c %Y "$TS_STATUS_CACHE"))) -lt "$TS_STATUS_TTL" ]; then
+            exit 0
+        fi
+        if ! timeout "$TS_STATUS_TIMEOUT" tailscale status --json > "$TS_STATUS_CACHE.tmp"; then
+            rm -f "$TS_STATUS_CACHE.tmp"
+            exit 1
+        fi
+        if jq -r "$TS_SUMMARY_JQ" "$TS_STATUS_CACHE.tmp" > "$TS_SUMMARY_CACHE.tmp" 2>/dev/null; then
+            mv -f "$TS_SUMMARY_CACHE.tmp" "$TS_SUMMARY_CACHE"
+        else
+            rm -f "$TS_SUMMARY_CACHE.tmp" "$TS_SUMMARY_CACHE"
+        fi
+        mv -f "$TS_STATUS_CACHE.tmp" "$TS_STATUS_CACHE"
+    ) 8>"$USB_ROUTER_RUN_DIR/tailscale-status.lock"
+}
+
+# Print `tailscale status --json`, from the cache when it can be used
+ts_status_json() {
+    [ "$TS_INSTALLED" = true ] || return 1
+    if ! ts_cache_usable; then
+        timeout "$TS_STATUS_TIMEOUT" tailscale status --json
+        return
+    fi
+    ts_status_refresh && cat "$TS_STATUS_CACHE"
+}
+
+# Print the exit node summary (see TS_SUMMARY_JQ)
+ts_exit_summary() {
+    [ "$TS_INSTALLED" = true ] || return 1
+    if ! ts_cache_usable; then
+        timeout "$TS_STATUS_TIMEOUT" tailscale status --json 2>/dev/null | jq -r "$TS_SUMMARY_JQ" 2>/dev/null
+        return
+    fi
+    ts_status_refresh 2>/dev/null && [ -f "$TS_SUMMARY_CACHE" ] && cat "$TS_SUMMARY_CACHE"
+}
+
+# Drop the cached Tailscale status after changing Tailscale settings
+ts_status_invalidate() {
+    rm -f "$TS_STATUS_CACHE" "$TS_SUMMARY_CACHE"
+}
+
+# Set TS_BACKEND_STATE, TS_EXIT_NODE (hostname of the peer in use, empty
+# if none), TS_EXIT_NODES (sorted peers offering to be an exit node) and
+# TS_EXIT_OPTIONS (their count) from the cached summary.
+ts_exit_node_info() {
+    local lines
+    mapfile -t lines < <(ts_exit_summary)
+    TS_BACKEND_STATE=${lines[0]:-}
+    TS_EXIT_NODE=${lines[1]:-}
+    TS_EXIT_NODES=("${lines[@]:2}")
+    TS_EXIT_OPTIONS=${#TS_EXIT_NODES[@]}
+}
+
+# Set only TS_BACKEND_STATE and TS_EXIT_NODE (head of the summary)
+ts_current_exit_node() {
+    TS_BACKEND_STATE=""
+    TS_EXIT_NODE=""
+    { read -r TS_BACKEND_STATE; read -r TS_EXIT_NODE; } < <(ts_exit_summary) || true
+}
+EOF
+    
     # Status check script
-    cat > /usr/local/bin/usb-router-status << 'EOF'
+    write_if_changed /usr/local/bin/usb-router-status 755 << 'EOF'
 #!/bin/bash
-echo "=== USB Router Status ==="
-echo
+. /usr/local/lib/usb-router/common.sh
+. /usr/local/lib/usb-router/tailscale.sh
+
 # Config (baked for this device)
 USB_NETWORK="192.168.64.0/24"
 TAILSCALE_INTERFACE="tailscale0"
 OPENVPN_INTERFACE="tun0"
+LEASES_FILE="/var/lib/misc/dnsmasq.leases"
+
+section_usb() {
+    echo "USB Interface:"
+    local sys=/sys/class/net/usb0 state carrier="" addrs=""
+    # Link state straight from sysfs; `ip` is only needed for the address
+    if ! read -r state 2>/dev/null < "$sys/operstate"; then
+        echo "  Interface not found"
+        return
+    fi
+    # carrier can only be read while the link is administratively up
+    read -r carrier 2>/dev/null < "$sys/carrier"
+    [ "$carrier" = 1 ] && state+=" (host connected)"
+    echo "  State: $state"
+    read -r _ _ addrs < <(ip -br -4 addr show dev usb0 2>/dev/null)
+    echo "  Address: ${addrs:-none}"
+}
 
-echo "USB Interface:"
-ip addr show usb0 2>/dev/null || echo "  Interface not found"
-echo
-echo "DHCP Leases:"
-if [ -f /var/lib/misc/dnsmasq.leases ]; then
-    cat /var/lib/misc/dnsmasq.leases | awk '{print "  "$3" - "$4}'
-else
-    echo "  No active leases"
-fi
-echo
-echo "NAT (nft) postrouting chain:"
-nft list chain ip usb_router_nat postrouting 2>/dev/null || echo "  (no usb_router_nat table)"
-echo
-echo "Forwarding (nft) forward chain:"
-nft list chain inet usb_router_filter forward 2>/dev/null || echo "  (no usb_router_filter table)"
-echo
-echo "Routing:"
-if ip rule show | grep -q "from $USB_NETWORK table usb_vpn"; then
-    echo "  USB clients use VPN routing table"
-    current_route=$(ip route show table usb_vpn 2>/dev/null | grep default || echo "No default route")
-    if echo "$current_route" | grep -q "$TAILSCALE_INTERFACE"; then
-        echo "  Active VPN: Tailscale"
-    elif echo "$current_route" | grep -q "$OPENVPN_INTERFACE"; then
-        echo "  Active VPN: OpenVPN (failover)"
+section_dhcp() {
+    echo "DHCP Leases:"
+    # Fields past the hostname (client id, which may hold spaces) land in
+    # $rest. dnsmasq writes "*" for clients that sent no hostname.
+    local expiry mac ip host rest count=0
+    if [ -f "$LEASES_FILE" ]; then
+        while read -r expiry mac ip host rest; do
+            [ -n "$host" ] || continue
+            [ "$host" = "*" ] && host="(no hostname)"
+            echo "  $ip - $host"
+            count=$((count + 1))
+        done < "$LEASES_FILE"
+    fi
+    if [ "$count" -eq 0 ]; then
+        echo "  No active leases"
+    fi
+}
+
+section_nat() {
+    echo "NAT (nft) postrouting chain:"
+    nft list chain ip usb_router_nat postrouting 2>/dev/null || echo "  (no usb_router_nat table)"
+}
+
+section_forward() {
+    echo "Forwarding (nft) forward chain:"
+    nft list chain inet usb_router_filter forward 2>/dev/null || echo "  (no usb_router_filter table)"
+}
+
+section_routing() {
+    echo "Routing:"
+    # Policy rule sending the USB network to usb_vpn
+    local rules
+    rules=$(exec ip rule list from "$USB_NETWORK" table usb_vpn 2>/dev/null)
+    if [ -n "$rules" ]; then
+        echo "  USB clients use VPN routing table"
+        # Find the default route in the usb_vpn table
+        local route current_route=""
+        while read -r route; do
+            [[ $route == default* ]] && current_route=$route && break
+        done < <(ip route show table usb_vpn 2>/dev/null)
+        if [[ $current_route == *"$TAILSCALE_INTERFACE"* ]]; then
+            echo "  Active VPN: Tailscale"
+        elif [[ $current_route == *"$OPENVPN_INTERFACE"* ]]; then
+            echo "  Active VPN: OpenVPN (failover)"
+        else
+            echo "  Active VPN: None configured"
+        fi
     else
-        echo "  Active VPN: None configured"
+        echo "  Traffic routed through: Local WAN"
+    fi
+}
+
+section_vpn() {
+    # Link state of each VPN interface
+    local ts_link=DOWN ovpn_link=DOWN
+    iface_exists $TAILSCALE_INTERFACE && ts_link=UP
+    iface_exists $OPENVPN_INTERFACE && ovpn_link=UP
+
+    echo "VPN Status:"
+    [ "$TS_INSTALLED" = true ] || ts_link="not installed"
+    echo "  Tailscale: $ts_link"
+    if [ "$ts_link" = "UP" ]; then
+        ts_current_exit_node
+        echo "  Tailscale exit node: ${TS_EXIT_NODE:-none}"
+    fi
+    echo "  OpenVPN: $ovpn_link"
+    if [ "${UNIT_STATE[usb-router-vpn-monitor]}" = "active" ]; then
+        echo "  Failover Monitor: Active"
+    else
+        echo "  Failover Monitor: Inactive"
+    fi
+}
+
+# "  label: active (running)" for a unit queried by unit_states
+unit_line() {
+    local sub=${UNIT_SUBSTATE[$2]}
+    echo "  $1: ${UNIT_STATE[$2]}${sub:+ ($sub)}"
+}
+
+section_services() {
+    echo "Services:"
+    unit_line dnsmasq dnsmasq
+    if [ "$TS_INSTALLED" = true ]; then
+        unit_line tailscale tailscaled
+    else
+        echo "  tailscale: not installed"
+    fi
+    unit_line "usb watchdog" usb-interface-watchdog
+}
+
+render_status() {
+    local i s tmp stamp units_loaded=false
+
+    # The sections are independent, so probe them concurrently. Output is
+    # still printed in a fixed order, each section as soon as it and all
+    # sections before it have finished.
+    local pids=() outs=() out lines
+    tmp=$(mktemp -d)
+    for s in "${SECTIONS[@]}"; do
+        # One systemctl call for every section that needs a unit state,
+        # made only once the sections before them are already running
+        if [ "$units_loaded" = false ] && [[ " ${UNIT_SECTIONS[*]} " == *" $s "* ]]; then
+            unit_states "${STATUS_UNITS[@]}"
+            units_loaded=true
+        fi
+        out="$tmp/$s"
+        if [ -n "$SECTION_CACHE" ] && [[ " ${CACHED_SECTIONS[*]} " == *" $s "* ]]; then
+            # Reuse the cached copy while valid, else re-render it in place
+            out="$SECTION_CACHE/section-$s"
+            if section_cache_valid "$s" "$out"; then
+                outs+=("$out")
+                pids+=("")
+                continue
+            fi
+            stamp=""
+            if [ "$s" = dhcp ]; then
+                stamp=$LEASE_STAMP
+            fi
+            { "section_$s" > "$out.tmp" 2>&1; mv -f "$out.tmp" "$out"; printf '%s\n' "$stamp" > "$out.stamp"; } &
+        else
+            "section_$s" > "$out" 2>&1 &
+        fi
+        outs+=("$out")
+        pids+=($!)
+    done
+
+    echo "=== USB Router Status ==="
+    for i in "${!SECTIONS[@]}"; do
+        if [ -n "${pids[$i]}" ]; then
+            wait "${pids[$i]}"
+        fi
+        mapfile -t lines < "${outs[$i]}"
+        printf '\n'
+        printf '%s\n' "${lines[@]}"
+    done
+    rm -rf "$tmp"
+}
+
+SECTIONS=(usb dhcp nat forward routing vpn services)
+# Sections reading UNIT_STATE; kept last so the systemctl query overlaps
+# with the probes of the sections before them
+UNIT_SECTIONS=(vpn services)
+# Every unit those sections report on, queried together
+readonly STATUS_UNITS=(dnsmasq tailscaled usb-router-vpn-monitor usb-interface-watchdog)
+
+# Repeated calls (e.g. a dashboard polling from several tabs) within
+# STATUS_TTL seconds share one rendered report. The lock makes concurrent
+# callers wait for a single refresh instead of each probing the system.
+# CACHED_SECTIONS outlive a report: nft ones for SLOW_TTL, DHCP until the leases change.
+CACHE_DIR=/run/usb-router
+CACHE_FILE="$CACHE_DIR/status.cache"
+STATUS_TTL="${USB_ROUTER_STATUS_TTL:-2}"
+STATUS_LOCK_WAIT=10  # past this, render uncached rather than queue behind a stuck refresh
+CACHED_SECTIONS=(dhcp nat forward)
+SLOW_TTL="${USB_ROUTER_STATUS_SLOW_TTL:-10}"
+SECTION_CACHE=""
+
+# True if the file exists and is younger than $2 seconds
+file_fresh() {
+    [ -f "$1" ] && [ $((EPOCHSECONDS - $(stat -c %Y "$1"))) -lt "$2" ]
+}
+
+# True if the cached copy $2 of section $1 can be shown as is
+# Lease file mtime and size, recorded before a DHCP render and checked against
+LEASE_STAMP=""
+lease_stamp() {
+    LEASE_STAMP=$(exec stat -c '%y %s' "$LEASES_FILE" 2>/dev/null)
+}
+
+section_cache_valid() {
+    local seen
+    case $1 in
+        # Valid while the lease file is unchanged since the copy was rendered
+        dhcp) lease_stamp && [ -f "$2" ] && read -r seen 2>/dev/null < "$2.stamp" && [ "$seen" = "$LEASE_STAMP" ] ;;
+        *) file_fresh "$2" "$SLOW_TTL" ;;
+    esac
+}
+
+if [ "$STATUS_TTL" -gt 0 ] 2>/dev/null && mkdir -p "$CACHE_DIR" 2>/dev/null && { exec 9>"$CACHE_DIR/status.lock"; } 2>/dev/null \
+    && flock -w "$STATUS_LOCK_WAIT" 9; then
+    SECTION_CACHE=$CACHE_DIR
+    if file_fresh "$CACHE_FILE" "$STATUS_TTL"; then
+        cat "$CACHE_FILE"
+    else
+        # Stream the report to this caller while it is written to the cache
+        render_status | tee "$CACHE_FILE.tmp" && mv -f "$CACHE_FILE.tmp" "$CACHE_FILE"
     fi
 else
-    echo "  Traffic routed through: Local WAN"
-fi
-echo ""
-echo "VPN Status:"
-echo "  Tailscale: $(ip link show $TAILSCALE_INTERFACE &>/dev/null && echo "UP" || echo "DOWN")"
-echo "  OpenVPN: $(ip link show $OPENVPN_INTERFACE &>/dev/null && echo "UP" || echo "DOWN")"
-if systemctl is-active usb-router-vpn-monitor &>/dev/null; then
-    echo "  Failover Monitor: Active"
-else
-    echo "  Failover Monitor: Inactive"
+    render_status
 fi
-echo
-echo "Services:"
-systemctl is-active dnsmasq | xargs echo "  dnsmasq:"
-systemctl is-active tailscaled | xargs echo "  tailscale:"
 EOF
-    chmod +x /usr/local/bin/usb-router-status
     
     # Tailscale routing switch script
-    cat > /usr/local/bin/usb-router-tailscale << 'EOF'
+    write_if_changed /usr/local/bin/usb-router-tailscale 755 << 'EOF'
 #!/bin/bash
 set -e
+. /usr/local/lib/usb-router/common.sh
+. /usr/local/lib/usb-router/tailscale.sh
 
 usage() {
-  echo "Usage: $0 {on|off|status}"
-  echo "  on     - Enable and select a Tailscale exit node"
+  echo "Usage: $0 {on [node]|off|status}"
+  echo "  on     - Enable and select a Tailscale exit node (prompts unless node is given)"
   echo "  off    - Disable exit node (no routing changes)"
   echo "  status - Show Tailscale status and current exit node"
   exit 1
 }
 
 require_ts() {
-  command -v tailscale >/dev/null 2>&1 || { echo "tailscale CLI not found"; exit 1; }
-  tailscale status >/dev/null 2>&1 || { echo "Tailscale not authenticated. Run: tailscale up"; exit 1; }
+  [ "$TS_INSTALLED" = true ] || { echo "tailscale CLI not found"; exit 1; }
+  # The backend state comes with the cached status summary the command
+  # reads next anyway, so checking it costs no extra tailscale call
+  ts_current_exit_node
+  [ "$TS_BACKEND_STATE" = "Running" ] || { echo "Tailscale not authenticated. Run: tailscale up"; exit 1; }
+}
+
+# Exit node changes are serialized: a second on/off while one is running is
+# rejected instead of racing it, and a change identical to one applied less
+# than a second ago (a double click in a UI) is skipped.
+CHANGE_STAMP="$USB_ROUTER_RUN_DIR/tailscale-change"
+
+lock_changes() {
+  mkdir -p "$USB_ROUTER_RUN_DIR" 2>/dev/null && exec 7>"$CHANGE_STAMP.lock" || return 0
+  flock -n 7 || { echo "Another exit node change is in progress"; exit 1; }
+}
+
+# The stamp holds the last change and its $EPOCHREALTIME on a second line
+recently_applied() {
+  local last="" at=""
+  [ -f "$CHANGE_STAMP" ] && { read -r last; read -r at; } < "$CHANGE_STAMP"
+  [ "$last" = "$1" ] && [[ $at =~ ^[0-9]+\.[0-9]{6}$ ]] &&
+    [ $(( ${EPOCHREALTIME/./} - ${at/./} )) -lt 1000000 ]
 }
 
-get_exit_nodes() {
-  tailscale status --json | jq -r '.Peer[] | select(.ExitNodeOption==true) | .HostName' 2>/dev/null || true
+mark_applied() {
+  printf "%s\n%s\n" "$1" "$EPOCHREALTIME" > "$CHANGE_STAMP" 2>/dev/null || true
+  ts_status_invalidate
+  # usb-router-status's cached report shows the exit node too
+  rm -f "$USB_ROUTER_RUN_DIR/status.cache"
 }
 
 select_exit_node() {
-  local nodes=($(get_exit_nodes))
-  if [ ${#nodes[@]} -eq 0 ]; then
+  # Sorted in the cached summary, so the selection menu is stable
+  ts_exit_node_info
+  local nodes=("${TS_EXIT_NODES[@]}")
+  if [ -n "$1" ]; then
+    # Non-interactive: only accept a node that is actually offered, using
+    # a set lookup instead of scanning the list
+    local -A offered=()
+    for n in "${nodes[@]}"; do offered[$n]=1; done
+    [ -n "${offered[$1]:-}" ] && { echo "$1"; return 0; }
+    echo ""; return 1
+  elif [ ${#nodes[@]} -eq 0 ]; then
     echo ""; return 1
   elif [ ${#nodes[@]} -eq 1 ]; then
     echo "${nodes[0]}"; return 0
@@ -614,120 +1190,392 @@ select_exit_node() {
 
 cmd_on() {
   require_ts
-  tailscale set --exit-node-allow-lan-access=true 2>/dev/null || true
-  node="$(select_exit_node)" || { echo "No exit nodes available. Ensure one is advertised and shared."; exit 1; }
+  lock_changes
+  if [ -n "$1" ]; then
+    node="$(select_exit_node "$1")" || { echo "Exit node $1 is not offered on this tailnet"; exit 1; }
+  else
+    node="$(select_exit_node)" || { echo "No exit nodes available. Ensure one is advertised and shared."; exit 1; }
+  fi
+  if recently_applied "on $node"; then
+    echo "Exit node $node was just enabled"
+    return
+  fi
   echo "Enabling exit node: $node"
+  tailscale set --exit-node-allow-lan-access=true 2>/dev/null || true
   tailscale set --exit-node="$node"
+  mark_applied "on $node"
 }
 
 cmd_off() {
   require_ts
+  lock_changes
+  if recently_applied "off"; then
+    echo "Exit node was just cleared"
+    return
+  fi
   echo "Clearing exit node"
   tailscale set --exit-node=
+  mark_applied "off"
 }
 
 cmd_status() {
+  # require_ts has already fetched the JSON status, so the exit node
+  # lookup below is served from the cache
   require_ts
   echo "Tailscale status:"
   tailscale status | sed 's/^/  /'
-  cur=$(tailscale status --json | jq -r '.Self.ExitNode | select(.!=null)')
-  if [ -n "$cur" ]; then
-    echo "Current exit node: $cur"
-  else
-    echo "Current exit node: none"
-  fi
+  ts_exit_node_info
+  echo "Current exit node: ${TS_EXIT_NODE:-none}"
+  echo "Available exit nodes: ${TS_EXIT_OPTIONS:-0}"
 }
 
 case "${1:-status}" in
-  on) cmd_on ;;
+  on) cmd_on "$2" ;;
   off) cmd_off ;;
   status) cmd_status ;;
   *) usage ;;
 esac
 EOF
-    chmod +x /usr/local/bin/usb-router-tailscale
     
     # VPN failover monitoring script
-    cat > /usr/local/bin/usb-router-vpn-monitor << 'EOF'
+    write_if_changed /usr/local/bin/usb-router-vpn-monitor 755 << 'EOF'
 #!/bin/bash
 # Monitor VPN connections and implement failover
+. /usr/local/lib/usb-router/common.sh
 
 LOG_FILE="/var/log/usb-router-vpn-monitor.log"
 CHECK_INTERVAL=30  # seconds
 PING_TIMEOUT=5     # seconds
-TEST_HOST="1.1.1.1"  # Cloudflare DNS for connectivity test
+BACKUP_PROBE_EVERY=5  # cycles between OpenVPN probes while Tailscale is healthy
+MIN_WAKE_GAP=5     # seconds between cycles started by link/route events
+EVENT_SETTLE=2     # seconds to let a burst of link/route events settle
+TEST_HOSTS=(1.1.1.1 8.8.8.8)  # Cloudflare and Google DNS for connectivity test
 USB_NETWORK="192.168.64.0/24"
 TAILSCALE_INTERFACE="tailscale0"
 OPENVPN_INTERFACE="tun0"
+STATE_FILE="/run/usb-router/vpn-monitor.state"
+
+log_open "$LOG_FILE"
+
+# Publish the result of the last cycle so `status` (and anything else that
+# wants the VPN state) can read it instead of re-probing every interface.
+# The file is only replaced when the state actually changed, so watchers
+# see one event per failover rather than one per cycle; otherwise just its
+# mtime is bumped to show the monitor is alive.
+PUBLISHED_STATE=""
+publish_state() {
+    local state
+    printf -v state 'current_vpn=%s\ntailscale_up=%s\nopenvpn_up=%s\nopenvpn_probed=%s\n' \
+        "$current_vpn" "$tailscale_up" "$openvpn_up" "$openvpn_probed"
+    if [ "$state" = "$PUBLISHED_STATE" ] && [ -f "$STATE_FILE" ]; then
+        touch "$STATE_FILE"
+        return
+    fi
+    mkdir -p "${STATE_FILE%/*}" 2>/dev/null || return 0
+    printf '%s' "$state" > "$STATE_FILE.tmp" && \
+        mv -f "$STATE_FILE.tmp" "$STATE_FILE" && \
+        PUBLISHED_STATE=$state
+}
 
-log_msg() {
-    echo "[$(date '+%Y-%m-%d %H:%M:%S')] $1" | tee -a "$LOG_FILE"
+# True if the running monitor published its state within the last two cycles
+state_fresh() {
+    [ -f "$STATE_FILE" ] && [ $((EPOCHSECONDS - $(stat -c %Y "$STATE_FILE"))) -lt $((CHECK_INTERVAL * 2)) ]
 }
 
+# An interface seen with an IPv4 address is trusted to still have one for
+# ADDR_TTL seconds without asking ip(8) again. Addresses change far less
+# often than the check interval, and losing one also fails the ping, which
+# drops the entry straight away.
+ADDR_TTL=$((CHECK_INTERVAL * 4))
+declare -A ADDR_SEEN=()
+ADDR_DUMP_AT=""
+
 check_interface() {
-    local interface=$1
-    ip link show "$interface" &>/dev/null && \
-    ip addr show "$interface" | grep -q "inet "
+    local interface=$1 seen
+    if ! iface_exists "$interface"; then
+        unset 'ADDR_SEEN[$interface]'
+        return 1
+    fi
+    seen=${ADDR_SEEN[$interface]:-}
+    if [ -n "$seen" ] && [ $((EPOCHSECONDS - seen)) -lt "$ADDR_TTL" ]; then
+        return 0
+    fi
+    # Needs an IPv4 address. One `ip -4 -o` dump per second (a line per
+    # address, interface name in the second field) covers every interface.
+    if [ "$ADDR_DUMP_AT" != "$EPOCHSECONDS" ]; then
+        ADDR_DUMP_AT=$EPOCHSECONDS
+        local _ name
+        while read -r _ name _; do
+            ADDR_SEEN[$name]=$ADDR_DUMP_AT
+        done < <(ip -4 -o addr show 2>/dev/null)
+    fi
+    if [ "${ADDR_SEEN[$interface]:-}" = "$ADDR_DUMP_AT" ]; then
+        return 0
+    fi
+    unset 'ADDR_SEEN[$interface]'
+    return 1
 }
 
+# True if any of TEST_HOSTS answers through the interface. The hosts are
+# pinged at once and the first reply wins, so a lost packet or one
+# unreachable host no longer fails the VPN, and the check still takes at
+# most one PING_TIMEOUT. Runs as its own background job (see
+# monitor_loop), so `wait -n` only ever sees these pings.
 check_connectivity() {
-    local interface=$1
-    ping -I "$interface" -c 1 -W "$PING_TIMEOUT" "$TEST_HOST" &>/dev/null
+    local interface=$1 host pending=0
+    local -a pids=()
+    for host in "${TEST_HOSTS[@]}"; do
+        # -n: never reverse-resolve the replying address (a DNS lookup through
+        # the very link being tested); -q: skip per-packet output nobody reads
+        ping -n -q -I "$interface" -c 1 -W "$PING_TIMEOUT" "$host" &>/dev/null &
+        pids+=($!)
+        pending=$((pending + 1))
+    done
+    while (( pending > 0 )); do
+        pending=$((pending - 1))
+        if wait -n; then
+            kill "${pids[@]}" 2>/dev/null
+            return 0
+        fi
+    done
+    return 1
 }
 
+# Set current_vpn to the VPN currently routing USB traffic (one table dump,
+# Tailscale preferred). While the monitor's event stream is up the answer
+# is kept (ROUTES_KNOWN) until wait_for_change sees a change; the switch_*
+# functions set current_vpn themselves. Without the stream every call
+# dumps the table again.
+VPN_EVENTS_LIVE=false
+ROUTES_KNOWN=false
 get_current_vpn() {
-    # Check which VPN is currently routing USB traffic
-    if ip route show table usb_vpn 2>/dev/null | grep -q "$TAILSCALE_INTERFACE"; then
-        echo "tailscale"
-    elif ip route show table usb_vpn 2>/dev/null | grep -q "$OPENVPN_INTERFACE"; then
-        echo "openvpn"
+    if $ROUTES_KNOWN; then
+        return 0
+    fi
+    ROUTES_KNOWN=$VPN_EVENTS_LIVE
+    local routes
+    routes=$(exec ip route show table usb_vpn 2>/dev/null)
+    if [[ $routes == *"$TAILSCALE_INTERFACE"* ]]; then
+        current_vpn="tailscale"
+    elif [[ $routes == *"$OPENVPN_INTERFACE"* ]]; then
+        current_vpn="openvpn"
     else
-        echo "none"
+        current_vpn="none"
+    fi
+}
+
+# Log a warning once per outage; repeats in consecutive cycles go to debug
+LAST_WARNING=""
+WARNED=false
+log_repeated_warning() {
+    WARNED=true
+    if [ "$1" != "$LAST_WARNING" ]; then
+        LAST_WARNING=$1
+        log_warning "$1"
+    else
+        log_debug "WARNING: $1"
     fi
 }
 
 switch_to_tailscale() {
+    # Routing is about to change; re-verify addresses on the next cycle
+    ADDR_SEEN=()
+    ADDR_DUMP_AT=""
     log_msg "Switching USB routing to Tailscale..."
     
-    # Update routing table
-    ip route del default table usb_vpn 2>/dev/null || true
-    local ts_gateway=$(ip route show dev $TAILSCALE_INTERFACE | grep -E '^100\.' | head -1 | awk '{print $1}')
+    # Update routing table. `replace` swaps the default route in one
+    # netlink request, so USB clients never see an empty usb_vpn table
+    # between a delete and an add.
+    # Gateway: the first 100.x destination routed via the Tailscale interface
+    local dest ts_gateway=""
+    while read -r dest _; do
+        if [[ $dest == 100.* ]]; then
+            ts_gateway=$dest
+            break
+        fi
+    done < <(ip route show dev $TAILSCALE_INTERFACE 2>/dev/null)
+    local via=()
     if [ -n "$ts_gateway" ]; then
-        ip route add default via $ts_gateway dev $TAILSCALE_INTERFACE table usb_vpn
-    else
-        ip route add default dev $TAILSCALE_INTERFACE table usb_vpn
+        via=(via "$ts_gateway")
+    fi
+    # A failed replace sends no route event; re-read the table next cycle
+    if ! ip route replace default "${via[@]}" dev $TAILSCALE_INTERFACE table usb_vpn; then
+        ROUTES_KNOWN=false
+        log_repeated_warning "Could not route USB traffic via Tailscale"
+        return 1
     fi
     
+    current_vpn="tailscale"
     log_msg "Switched to Tailscale successfully"
 }
 
 switch_to_openvpn() {
+    # Routing is about to change; re-verify addresses on the next cycle
+    ADDR_SEEN=()
+    ADDR_DUMP_AT=""
     log_msg "Switching USB routing to OpenVPN..."
     
-    # Update routing table
-    ip route del default table usb_vpn 2>/dev/null || true
+    # Update routing table (atomic swap, see switch_to_tailscale).
     # OpenVPN usually sets up routes automatically, just use the interface
-    ip route add default dev $OPENVPN_INTERFACE table usb_vpn
+    if ! ip route replace default dev $OPENVPN_INTERFACE table usb_vpn; then
+        ROUTES_KNOWN=false
+        log_repeated_warning "Could not route USB traffic via OpenVPN"
+        return 1
+    fi
     
+    current_vpn="openvpn"
     log_msg "Switched to OpenVPN successfully"
 }
 
+# True if an ip monitor line means routing may have changed under us: a
+# usb_vpn route other than the one current_vpn already accounts for (so
+# our own switch_* replace is ignored), or a VPN link changing state
+declare -A LINK_SEEN=()
+relevant_event() {
+    local line=$1 iface sig
+    case "$line" in
+        *" table usb_vpn"*)
+            case "$current_vpn" in
+                tailscale) iface=$TAILSCALE_INTERFACE ;;
+                openvpn) iface=$OPENVPN_INTERFACE ;;
+                *) return 0 ;;
+            esac
+            if [[ $line != Deleted* && $line == *" dev $iface "* ]]; then
+                return 1
+            fi
+            return 0
+            ;;
+    esac
+    for iface in "$TAILSCALE_INTERFACE" "$OPENVPN_INTERFACE"; do
+        case "$line" in
+            "Deleted "*": $iface:"*|"Deleted "*": $iface@"*)
+                unset 'LINK_SEEN[$iface]'
+                return 0
+                ;;
+            *": $iface:"*|*": $iface@"*)
+                # Only operstate and carrier count, not flag or MTU updates
+                sig=${line#* state }
+                sig=${sig%% *}
+                if [[ $line == *LOWER_UP* ]]; then
+                    sig+=+carrier
+                fi
+                if [ "${LINK_SEEN[$iface]:-}" = "$sig" ]; then
+                    return 1
+                fi
+                LINK_SEEN[$iface]=$sig
+                return 0
+                ;;
+        esac
+    done
+    return 1
+}
+
+# Sleep for up to $1 seconds; return 0 early once a relevant_event has
+# settled for EVENT_SETTLE seconds, but no sooner than MIN_WAKE_GAP after
+# the last cycle started
+LAST_CYCLE_AT=0
+wait_for_change() {
+    local deadline=$((SECONDS + $1)) wake_at=0 line rc left
+    
+    while true; do
+        left=$((deadline - SECONDS))
+        if (( wake_at > 0 && wake_at - SECONDS < left )); then
+            left=$((wake_at - SECONDS))
+        fi
+        if (( left <= 0 )); then
+            break
+        fi
+        rc=0
+        read -r -t $left -u $VPN_EVENTS line || rc=$?
+        if (( rc > 128 )); then
+            continue
+        elif (( rc != 0 )); then
+            # ip monitor is gone: fall back to the plain periodic check
+            VPN_EVENTS_LIVE=false
+            ROUTES_KNOWN=false
+            left=$((deadline - SECONDS))
+            if (( left > 0 )); then
+                sleep $left
+            fi
+            break
+        fi
+        if relevant_event "$line" && (( wake_at == 0 )); then
+            wake_at=$((SECONDS + EVENT_SETTLE))
+            if (( wake_at < LAST_CYCLE_AT + MIN_WAKE_GAP )); then
+                wake_at=$((LAST_CYCLE_AT + MIN_WAKE_GAP))
+            fi
+        fi
+    done
+    (( wake_at > 0 ))
+}
+
 monitor_loop() {
     log_msg "VPN failover monitor started"
     
+    # One long-lived netlink subscription, opened before the first check so
+    # no change is missed between the probes and the wait
+    exec {VPN_EVENTS}< <(exec ip -o monitor link route 2>/dev/null)
+    VPN_EVENTS_LIVE=true
+    
+    local next_check=$SECONDS left ts_pid ovpn_pid cycle=0 probe_ovpn ovpn_probed_at=""
+    openvpn_up=false
     while true; do
-        current_vpn=$(get_current_vpn)
+        # Cycles start every CHECK_INTERVAL seconds: time spent probing
+        # (up to PING_TIMEOUT per ping) comes out of the sleep rather than
+        # stretching the interval
+        next_check=$((next_check + CHECK_INTERVAL))
+        LAST_CYCLE_AT=$SECONDS
+        WARNED=false
+        get_current_vpn
         tailscale_up=false
-        openvpn_up=false
         
-        # Check Tailscale
-        if check_interface "$TAILSCALE_INTERFACE" && check_connectivity "$TAILSCALE_INTERFACE"; then
-            tailscale_up=true
+        # While Tailscale carries the traffic, OpenVPN only matters once
+        # Tailscale fails: probe it every BACKUP_PROBE_EVERY cycles, keeping
+        # the last result in between, or straight after a failed Tailscale
+        # probe. Otherwise Tailscale is preferred and both are needed.
+        probe_ovpn=true
+        if [ "$current_vpn" = "tailscale" ] && (( cycle % BACKUP_PROBE_EVERY != 0 )); then
+            probe_ovpn=false
         fi
+        cycle=$((cycle + 1))
         
-        # Check OpenVPN
-        if check_interface "$OPENVPN_INTERFACE" && check_connectivity "$OPENVPN_INTERFACE"; then
-            openvpn_up=true
+        # Probe the VPNs side by side: the pings spend their time waiting
+        # on the network, so a cycle costs at most one PING_TIMEOUT
+        # instead of one per VPN
+        ts_pid=""
+        ovpn_pid=""
+        if check_interface "$TAILSCALE_INTERFACE"; then
+            check_connectivity "$TAILSCALE_INTERFACE" &
+            ts_pid=$!
+        fi
+        if $probe_ovpn && check_interface "$OPENVPN_INTERFACE"; then
+            check_connectivity "$OPENVPN_INTERFACE" &
+            ovpn_pid=$!
+        fi
+        if [ -n "$ts_pid" ] && wait "$ts_pid"; then
+            tailscale_up=true
+        else
+            unset 'ADDR_SEEN[$TAILSCALE_INTERFACE]'
+            if ! $probe_ovpn; then
+                probe_ovpn=true
+                if check_interface "$OPENVPN_INTERFACE"; then
+                    check_connectivity "$OPENVPN_INTERFACE" &
+                    ovpn_pid=$!
+                fi
+            fi
+        fi
+        # openvpn_probed: when a carried-over OpenVPN result was measured
+        if $probe_ovpn; then
+            openvpn_up=false
+            if [ -n "$ovpn_pid" ] && wait "$ovpn_pid"; then
+                openvpn_up=true
+            else
+                unset 'ADDR_SEEN[$OPENVPN_INTERFACE]'
+            fi
+            ovpn_probed_at=$EPOCHSECONDS
+            openvpn_probed=""
+        else
+            openvpn_probed=$ovpn_probed_at
         fi
         
         # Implement failover logic
@@ -743,7 +1591,7 @@ monitor_loop() {
                     log_msg "Tailscale is back up, switching back from OpenVPN"
                     switch_to_tailscale
                 elif ! $openvpn_up; then
-                    log_msg "WARNING: OpenVPN is down and Tailscale unavailable!"
+                    log_repeated_warning "OpenVPN is down and Tailscale unavailable!"
                 fi
                 ;;
             "none")
@@ -754,21 +1602,74 @@ monitor_loop() {
                     log_msg "OpenVPN available, enabling VPN routing"
                     switch_to_openvpn
                 else
-                    log_msg "WARNING: No VPN connections available!"
+                    log_repeated_warning "No VPN connections available!"
                 fi
                 ;;
         esac
+        # A cycle without a warning ends the outage; the next one is logged
+        if ! $WARNED; then
+            LAST_WARNING=""
+        fi
         
-        sleep "$CHECK_INTERVAL"
+        publish_state
+        left=$((next_check - SECONDS))
+        if [ "$left" -gt 0 ]; then
+            if wait_for_change "$left"; then
+                # Something moved: probe now, with fresh addresses and
+                # routes, and restart the interval from here
+                ADDR_SEEN=()
+                ADDR_DUMP_AT=""
+                ROUTES_KNOWN=false
+                next_check=$SECONDS
+            fi
+        else
+            # Overran a whole interval; don't try to catch up with back-to-back cycles
+            next_check=$SECONDS
+        fi
     done
 }
 
 # Command line interface
 case "${1:-monitor}" in
     "status")
-        echo "Current VPN: $(get_current_vpn)"
-        echo "Tailscale: $(check_interface $TAILSCALE_INTERFACE && echo "UP" || echo "DOWN")"
-        echo "OpenVPN: $(check_interface $OPENVPN_INTERFACE && echo "UP" || echo "DOWN")"
+        reported=""
+        openvpn_probed=""
+        if state_fresh; then
+            . "$STATE_FILE"
+            reported="(reported by monitor $((EPOCHSECONDS - $(stat -c %Y "$STATE_FILE")))s ago)"
+        else
+            # No monitor running: probe the same way it does, so UP always
+            # means the link answered a ping
+            get_current_vpn
+            tailscale_up=false
+            openvpn_up=false
+            ts_pid=""
+            ovpn_pid=""
+            if check_interface $TAILSCALE_INTERFACE; then
+                check_connectivity $TAILSCALE_INTERFACE &
+                ts_pid=$!
+            fi
+            if check_interface $OPENVPN_INTERFACE; then
+                check_connectivity $OPENVPN_INTERFACE &
+                ovpn_pid=$!
+            fi
+            if [ -n "$ts_pid" ] && wait "$ts_pid"; then
+                tailscale_up=true
+            fi
+            if [ -n "$ovpn_pid" ] && wait "$ovpn_pid"; then
+                openvpn_up=true
+            fi
+        fi
+        ovpn_age=""
+        if [ -n "$openvpn_probed" ]; then
+            ovpn_age=" (probed $((EPOCHSECONDS - openvpn_probed))s ago)"
+        fi
+        echo "Current VPN: $current_vpn"
+        [ "$tailscale_up" = true ] && echo "Tailscale: UP" || echo "Tailscale: DOWN"
+        [ "$openvpn_up" = true ] && echo "OpenVPN: UP$ovpn_age" || echo "OpenVPN: DOWN$ovpn_age"
+        if [ -n "$reported" ]; then
+            echo "$reported"
+        fi
         ;;
     "monitor")
         monitor_loop
@@ -779,10 +1680,9 @@ case "${1:-monitor}" in
         ;;
 esac
 EOF
-    chmod +x /usr/local/bin/usb-router-vpn-monitor
     
     # Create systemd service for VPN monitor
-    cat > /etc/systemd/system/usb-router-vpn-monitor.service << EOF
+    write_unit /etc/systemd/system/usb-router-vpn-monitor.service << EOF
 [Unit]
 Description=USB Router VPN Failover Monitor
 After=network.target tailscaled.service
@@ -791,6 +1691,7 @@ Wants=tailscaled.service
 [Service]
 Type=simple
 ExecStart=/usr/local/bin/usb-router-vpn-monitor monitor
+Environment=USB_ROUTER_DEBUG=$USB_ROUTER_DEBUG
 Restart=always
 RestartSec=10
 StandardOutput=journal
@@ -801,35 +1702,51 @@ WantedBy=multi-user.target
 EOF
     
     # Create USB interface watchdog to handle macOS permission delays
-    cat > /usr/local/bin/usb-interface-watchdog << 'EOF'
+    write_if_changed /usr/local/bin/usb-interface-watchdog 755 << 'EOF'
 #!/bin/bash
 # Watchdog to handle USB interface appearing after macOS permission approval
+. /usr/local/lib/usb-router/common.sh
 
 LOG_FILE="/var/log/usb-interface-watchdog.log"
 USB_INTERFACE="usb0"
+USB_IP="192.168.64.1"
 CHECK_INTERVAL=10
 MAX_WAIT=300  # 5 minutes max wait
 
-log_msg() {
-    echo "[$(date '+%Y-%m-%d %H:%M:%S')] $1" | tee -a "$LOG_FILE"
+log_open "$LOG_FILE"
+
+dnsmasq_bound() {
+    # dnsmasq runs with bind-interfaces, so once it has picked up the USB
+    # interface it holds a DNS socket on the USB address. Asking the kernel
+    # is far cheaper than scraping `systemctl status` and its journal tail.
+    [ -n "$(exec ss -Hlnu "src $USB_IP:53" 2>/dev/null)" ]
 }
 
 wait_for_interface() {
-    local waited=0
+    local deadline=$((SECONDS + MAX_WAIT)) events monitor_pid rc
+    
+    # Subscribe to kernel link notifications before the first check, so an
+    # interface that shows up in between still wakes us. The USB host can
+    # take minutes to allow the gadget; sleeping CHECK_INTERVAL between
+    # sysfs checks added up to that much delay once it finally appeared.
+    exec {events}< <(exec ip -o monitor link 2>/dev/null)
+    monitor_pid=$!
     
-    while [ $waited -lt $MAX_WAIT ]; do
-        if ip link show $USB_INTERFACE &>/dev/null; then
+    while [ $SECONDS -lt $deadline ]; do
+        if iface_exists $USB_INTERFACE; then
+            kill $monitor_pid 2>/dev/null
+            exec {events}<&-
             log_msg "USB interface $USB_INTERFACE detected!"
             
             # Configure the interface
             ip link set $USB_INTERFACE up
-            ip addr add 192.168.64.1/24 dev $USB_INTERFACE 2>/dev/null || true
+            ip addr add $USB_IP/24 dev $USB_INTERFACE 2>/dev/null || true
             
             # Restart dnsmasq if it's not running
             if ! systemctl is-active dnsmasq &>/dev/null; then
                 log_msg "Starting dnsmasq..."
                 systemctl restart dnsmasq
-            elif ! systemctl status dnsmasq | grep -q "usb0"; then
+            elif ! dnsmasq_bound; then
                 log_msg "Restarting dnsmasq to bind to USB interface..."
                 systemctl restart dnsmasq
             fi
@@ -837,11 +1754,19 @@ wait_for_interface() {
             return 0
         fi
         
-        sleep $CHECK_INTERVAL
-        waited=$((waited + CHECK_INTERVAL))
+        # Wake on the next link event, re-checking at least every
+        # CHECK_INTERVAL. End of stream means ip monitor is gone, so fall
+        # back to plain polling instead of spinning.
+        rc=0
+        read -r -t $CHECK_INTERVAL -u $events _ || rc=$?
+        if (( rc > 0 && rc <= 128 )); then
+            sleep $CHECK_INTERVAL
+        fi
     done
     
-    log_msg "Timeout waiting for USB interface"
+    kill $monitor_pid 2>/dev/null
+    exec {events}<&-
+    log_warning "Timeout waiting for USB interface"
     return 1
 }
 
@@ -849,13 +1774,13 @@ monitor_interface() {
     log_msg "USB interface watchdog started"
     
     while true; do
-        if ! ip link show $USB_INTERFACE &>/dev/null; then
+        if ! iface_exists $USB_INTERFACE; then
             log_msg "USB interface not found, waiting for macOS permission..."
             wait_for_interface
         else
             # Check if dnsmasq is healthy
             if ! systemctl is-active dnsmasq &>/dev/null; then
-                log_msg "dnsmasq is not running, restarting..."
+                log_warning "dnsmasq is not running, restarting..."
                 systemctl restart dnsmasq
             fi
         fi
@@ -869,9 +1794,15 @@ case "${1:-monitor}" in
         monitor_interface
         ;;
     "check")
-        if ip link show $USB_INTERFACE &>/dev/null; then
-            echo "USB interface: UP"
-            systemctl is-active dnsmasq && echo "dnsmasq: ACTIVE" || echo "dnsmasq: INACTIVE"
+        # One sysfs read answers both "does it exist" and "what state is it in"
+        if read -r state 2>/dev/null < "/sys/class/net/$USB_INTERFACE/operstate"; then
+            if [ "$state" = "up" ]; then
+                echo "USB interface: UP"
+            else
+                echo "USB interface: present (link $state)"
+            fi
+            unit_states dnsmasq
+            [ "${UNIT_STATE[dnsmasq]}" = "active" ] && echo "dnsmasq: ACTIVE" || echo "dnsmasq: INACTIVE"
         else
             echo "USB interface: DOWN (waiting for macOS permission?)"
         fi
@@ -882,10 +1813,9 @@ case "${1:-monitor}" in
         ;;
 esac
 EOF
-    chmod +x /usr/local/bin/usb-interface-watchdog
     
     # Create systemd service for USB watchdog
-    cat > /etc/systemd/system/usb-interface-watchdog.service << EOF
+    write_unit /etc/systemd/system/usb-interface-watchdog.service << EOF
 [Unit]
 Description=USB Interface Watchdog for macOS Permission Delays
 After=network.target
@@ -896,6 +1826,10 @@ Type=simple
 ExecStart=/usr/local/bin/usb-interface-watchdog monitor
 Restart=always
 RestartSec=10
+# Housekeeping loop: yield CPU and disk to dnsmasq and the VPN daemons
+Nice=10
+IOSchedulingClass=best-effort
+IOSchedulingPriority=7
 StandardOutput=journal
 StandardError=journal
 
@@ -903,12 +1837,11 @@ StandardError=journal
 WantedBy=multi-user.target
 EOF
     
-    systemctl daemon-reload
-    systemctl enable usb-interface-watchdog.service
+    ENABLE_UNITS+=(usb-interface-watchdog.service)
     log_info "USB interface watchdog enabled (handles macOS permission delays)"
     
     if [ "$USE_VPN_FAILOVER" = "true" ]; then
-        systemctl enable usb-router-vpn-monitor.service
+        ENABLE_UNITS+=(usb-router-vpn-monitor.service)
         log_info "VPN failover monitoring enabled"
     fi
 }
@@ -918,6 +1851,8 @@ main() {
     log_info "Starting USB Router Setup..."
     
     check_root
+    check_bash_version
+    validate_network_config
     detect_distro
     load_board_plugin
     install_packages
@@ -932,16 +1867,20 @@ main() {
     setup_openvpn
     setup_tailscale
     create_helper_scripts
+    finalize_systemd_units
     
-    # Restart services
-    log_info "Restarting services..."
-    systemctl restart systemd-networkd || true
-    
-    # Try to bring up usb0 if module is loaded
-    if lsmod | grep -q g_ether; then
-        sleep 2
+    # systemd-networkd was already restarted by setup_network_interface if
+    # its config changed; dnsmasq is restarted only for a new config, so a
+    # re-run with nothing to change leaves the USB link alone
+    if module_loaded g_ether; then
+        wait_for_iface "$USB_INTERFACE" || true
         ip link set $USB_INTERFACE up 2>/dev/null || true
-        systemctl restart dnsmasq || true
+        if [ "$DNSMASQ_CHANGED" = "true" ]; then
+            log_info "Restarting dnsmasq..."
+            systemctl restart dnsmasq || true
+        else
+            systemctl start dnsmasq || true
+        fi
     fi
     
     # Check if reboot is required (for RK3399 boards)
@@ -961,8 +1900,9 @@ main() {
         fi
     else
         # Check if UDC is available (for boards that don't need reboot)
-        if ls /sys/class/udc/ 2>/dev/null | grep -q .; then
-            log_info "USB Device Controller found: $(ls /sys/class/udc/)"
+        local udcs=(/sys/class/udc/*)
+        if [ -e "${udcs[0]}" ]; then
+            log_info "USB Device Controller found: ${udcs[*]##*/}"
             log_info "USB gadget should be working!"
         else
             log_warn "No USB Device Controller found. You may need to reboot."